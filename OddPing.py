@@ -1,15 +1,25 @@
 import pygame
 import win32gui
 import win32con
-from collections import deque
+import numpy as np
 import time
-from ping3 import ping
+import threading
+from queue import Queue, Empty
+from collections import OrderedDict
+import asyncio
+from icmplib import async_ping
 from dataclasses import dataclass, asdict
-from typing import Dict, List
+from typing import Dict, List, Tuple
 import json
 import os
 import sys
 
+# Numba is optional; without it the projection runs as plain NumPy
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # Window Configuration
 @dataclass
 class WindowConfig:
@@ -22,6 +32,11 @@ class WindowConfig:
     padding_left: int = 10    # Separate padding for left and right
     padding_right: int = 10   # to control graph edges precisely
 
+    def __post_init__(self):
+        # Ensure color is a tuple to match the field type
+        if isinstance(self.background_color, list):
+            self.background_color = tuple(self.background_color)
+
 # Visual Configuration
 @dataclass
 class VisualConfig:
@@ -43,6 +58,14 @@ class VisualConfig:
     def __post_init__(self):
         if self.guide_levels is None:
             self.guide_levels = [50, 100, 150]  # Default guide levels
+        
+        # Ensure colors and offset are tuples to match the field types
+        if isinstance(self.ping_text_offset, list):
+            self.ping_text_offset = tuple(self.ping_text_offset)
+        if isinstance(self.text_color, list):
+            self.text_color = tuple(self.text_color)
+        if isinstance(self.guide_lines_color, list):
+            self.guide_lines_color = tuple(self.guide_lines_color)
 
 # Server Configuration
 @dataclass
@@ -57,6 +80,49 @@ class ServerConfig:
         if isinstance(self.color, list):
             self.color = tuple(self.color)
 
+# Fixed-size history of ping values, stored in a caller-provided array
+class RingBuffer:
+    def __init__(self, buf: np.ndarray):
+        self.buf = buf
+        self.head = 0  # Index of the oldest value
+        self.size = len(buf)
+
+    def append(self, value: float) -> float:
+        """Store a value, returning the oldest value it replaced."""
+        evicted = float(self.buf[self.head])
+        self.buf[self.head] = value
+        self.head = (self.head + 1) % self.size
+        return evicted
+
+    def ordered(self) -> np.ndarray:
+        """Return the values oldest first as a contiguous array."""
+        return np.concatenate((self.buf[self.head:], self.buf[:self.head]))
+
+    def latest(self, count: int) -> np.ndarray:
+        """Return the newest count values, oldest first."""
+        return self.buf[(self.head - count + np.arange(count)) % self.size]
+
+if njit is not None:
+    # Numba can only cache compiled code next to a source file, which frozen builds don't have
+    @njit(cache=not getattr(sys, 'frozen', False))
+    def project_points(values, xs, height, max_ping):
+        """Convert ping values into (x, y) pixel coordinates."""
+        points = np.empty((values.shape[0], 2), dtype=np.int32)
+        for i in range(values.shape[0]):
+            points[i, 0] = xs[i]
+            points[i, 1] = np.int32(np.rint(height - (values[i] / max_ping) * (height - 20)))  # Fixed padding for bottom
+        return points
+else:
+    def project_points(values, xs, height, max_ping):
+        """Convert ping values into (x, y) pixel coordinates."""
+        points = np.empty((values.shape[0], 2), dtype=np.int32)
+        points[:, 0] = xs
+        points[:, 1] = np.rint(height - (values / max_ping) * (height - 20)).astype(np.int32)  # Fixed padding for bottom
+        return points
+
+# Posted by the ping thread to wake the main loop when a new ping arrives
+PING_EVENT = pygame.USEREVENT
+
 # Default servers with their configurations
 DEFAULT_SERVERS = [
     ServerConfig("1.1.1.1", (255, 255, 0), 2),  # Yellow
@@ -146,13 +212,19 @@ class PingVisualizer:
         )
         pygame.display.set_caption("Ping Visualizer")
         
+        # The native window handle never changes, so look it up once
+        self.hwnd = pygame.display.get_wm_info()["window"]
+        
         # Window properties
         if self.window_config.transparent or self.window_config.always_on_top:
-            hwnd = pygame.display.get_wm_info()["window"]
+            hwnd = self.hwnd
             
             if self.window_config.transparent:
                 win32gui.SetWindowLong(hwnd, win32con.GWL_EXSTYLE,
                                      win32gui.GetWindowLong(hwnd, win32con.GWL_EXSTYLE) | win32con.WS_EX_LAYERED)
+                # Color-key rather than LWA_ALPHA: LWA_ALPHA fades the whole window
+                # uniformly, and per-pixel alpha needs UpdateLayeredWindow, which
+                # bypasses the frames SDL presents to this window
                 win32gui.SetLayeredWindowAttributes(hwnd, 0x000000, 0, win32con.LWA_COLORKEY)
             
             if self.window_config.always_on_top:
@@ -162,21 +234,86 @@ class PingVisualizer:
         # Initialize font
         self.font = pygame.font.SysFont('arial', self.visual_config.font_size)
         
+        # Rendered ping labels keyed by (value, color), least recently used first
+        self.text_cache: Dict[Tuple[int, tuple], pygame.Surface] = OrderedDict()
+        self.text_cache_size = 512
+        
         # Initialize data storage for each server
         self.ping_data = {}
         self.current_max_ping = max(self.visual_config.guide_levels) * 1.5
         self.target_max_ping = self.current_max_ping
-        self.last_ping_time = 0
+        self.guide_max_ping = max(self.visual_config.guide_levels) * 1.2
+        self.highest_ping = 0
+        self.highest_dirty = False  # Set when the highest ping leaves the history
         
-        for server in self.servers:
+        # All histories share one (servers, points) array so the highest
+        # ping is a single reduction
+        self.ping_history = np.zeros(
+            (len(self.servers), self.visual_config.max_points), 
+            dtype=np.float32
+        )
+        for index, server in enumerate(self.servers):
             self.ping_data[server.address] = {
-                'values': deque([0] * self.visual_config.max_points, maxlen=self.visual_config.max_points),
-                'last_value': 0
+                'values': RingBuffer(self.ping_history[index]),
+                'last_value': 0,
+                # Cached rendering of this server's line, scrolled as samples arrive
+                'graph': pygame.Surface(
+                    (self.window_config.width, self.window_config.height), 
+                    pygame.SRCALPHA
+                ),
+                'graph_scale': None,  # Scale the graph surface was drawn at
+                'graph_drift': 0.0,   # Sub-pixel error accumulated by scrolling
+                'last_point': (0, 0),  # Newest point on the graph surface
+                'new_samples': 0      # Samples appended since the last draw
             }
         
+        # X coordinates are the same for every server and every frame
+        graph_width = self.window_config.width - self.window_config.padding_left - self.window_config.padding_right
+        step = graph_width / (self.visual_config.max_points - 1)
+        offsets = self.visual_config.max_points - 1 - np.arange(self.visual_config.max_points)
+        self.xs = np.rint(self.window_config.width - self.window_config.padding_right - offsets * step).astype(np.int32)
+        self.x_step = step
+        self.scroll_step = max(1, int(round(step)))
+        
+        # With more points than pixel columns, draw one point per column using
+        # the column's highest ping so spikes stay visible
+        if self.visual_config.max_points > 2 * graph_width:
+            self.column_starts = np.linspace(0, self.visual_config.max_points, graph_width + 1).astype(np.intp)[:-1]
+            column_ends = np.append(self.column_starts[1:], self.visual_config.max_points) - 1
+            self.column_xs = self.xs[column_ends]
+        else:
+            self.column_starts = None
+        
+        # Trigger Numba's compile here rather than on the first drawn frame
+        project_points(
+            np.zeros(self.visual_config.max_points, dtype=np.float32),
+            self.xs,
+            self.window_config.height,
+            float(self.current_max_ping)
+        )
+        
+        # Guide lines are static geometry, so render them once and reuse the surface
+        self.guide_surface = pygame.Surface(
+            (self.window_config.width, self.window_config.height), 
+            pygame.SRCALPHA
+        )
+        self.guide_scale = None
+        # Guide y coordinates keyed by quantized scale, least recently used first
+        self.guide_y_cache: Dict[int, List[int]] = OrderedDict()
+        self.guide_y_cache_size = 256
+        if self.visual_config.show_guides:
+            self.draw_guide_lines()
+        self.graph_rect = pygame.Rect(0, 0, self.window_config.width, self.window_config.height)
+        
         self.running = True
+        self.dirty = True  # Set whenever the graph needs to be redrawn
         self.dragging = False
         self.drag_offset = (0, 0)
+        
+        # Ping servers in the background so a slow reply never stalls rendering
+        self.ping_queue = Queue()
+        self.ping_thread = threading.Thread(target=self.ping_worker, daemon=True)
+        self.ping_thread.start()
     
     def load_config(self, config_file: str):
         """Load configuration from a JSON file."""
@@ -199,79 +336,205 @@ class PingVisualizer:
             json.dump(config, f, indent=4)
         print(f"Saved configuration to: {config_file}")
     
-    def get_ping(self, server: str) -> int:
-        try:
-            result = ping(server, timeout=1)
-            if result is not None:
-                return int(result * 1000)  # Convert to milliseconds
-        except:
-            pass
-        return 0
+    def get_pings(self, loop: asyncio.AbstractEventLoop, addresses: List[str]) -> List[int]:
+        """Ping all addresses in parallel, returning 0 for any that fail."""
+        async def ping_all():
+            # Exceptions are returned per host so one bad address doesn't zero the rest
+            return await asyncio.gather(
+                *(async_ping(address, count=1, timeout=1, privileged=False) for address in addresses),
+                return_exceptions=True
+            )
+        
+        hosts = loop.run_until_complete(ping_all())
+        return [
+            int(host.avg_rtt) if not isinstance(host, BaseException) and host.is_alive else 0
+            for host in hosts
+        ]
     
-    def update_scale(self):
-        # Find highest ping across all servers
-        highest_ping = 0
-        for server_data in self.ping_data.values():
-            highest_ping = max(highest_ping, max(server_data['values']))
+    def update_scale(self, elapsed: float):
+        """Move the scale towards its target; elapsed is the time since the last frame in seconds."""
+        # Find highest ping across all servers with a single reduction over the
+        # stacked history, only when the previous highest has been evicted
+        if self.highest_dirty:
+            self.highest_ping = float(self.ping_history.max())
+            self.highest_dirty = False
         
         # Update target scale
-        self.target_max_ping = max(
-            highest_ping * 1.2,
-            max(self.visual_config.guide_levels) * 1.2
-        )
+        target = max(self.highest_ping * 1.2, self.guide_max_ping)
         
         # Smoothly adjust current scale
-        if self.current_max_ping < self.target_max_ping:
-            self.current_max_ping = self.target_max_ping
+        previous = self.current_max_ping
+        if previous < target:
+            current = target
         else:
-            self.current_max_ping = max(
-                self.target_max_ping,
-                self.current_max_ping * self.visual_config.scale_decay_rate
-            )
+            # scale_decay_rate is per frame at the configured fps
+            decay = self.visual_config.scale_decay_rate ** (elapsed * self.visual_config.fps)
+            current = max(target, previous * decay)
+        self.target_max_ping = target
+        self.current_max_ping = current
+        
+        # Redraw while the scale is still visibly moving
+        if abs(current - previous) > 0.01:
+            self.dirty = True
+        
+        # Only re-render the guides once the scale crosses a quantization step
+        if self.visual_config.show_guides and self.quantize_scale(current) != self.guide_scale:
+            self.draw_guide_lines()
+    
+    def ping_worker(self):
+        """Ping all enabled servers once per interval and post the results to the queue."""
+        addresses = [server.address for server in self.servers if server.enabled]
+        # One event loop for the lifetime of the thread
+        loop = asyncio.new_event_loop()
+        
+        while self.running:
+            start_time = time.time()
+            if addresses:
+                for address, ping_value in zip(addresses, self.get_pings(loop, addresses)):
+                    self.ping_queue.put((address, ping_value))
+                try:
+                    pygame.event.post(pygame.event.Event(PING_EVENT))
+                except pygame.error:
+                    pass  # Display already shut down
+            time.sleep(max(0, self.visual_config.ping_interval - (time.time() - start_time)))
+        
+        loop.close()
     
     def update_values(self):
-        current_time = time.time()
-        if current_time - self.last_ping_time >= self.visual_config.ping_interval:
-            for server in self.servers:
-                if server.enabled:
-                    ping_value = self.get_ping(server.address)
-                    self.ping_data[server.address]['values'].append(ping_value)
-                    self.ping_data[server.address]['last_value'] = ping_value
-            self.last_ping_time = current_time
+        while True:
+            try:
+                address, ping_value = self.ping_queue.get_nowait()
+            except Empty:
+                break
+            server_data = self.ping_data[address]
+            evicted = server_data['values'].append(ping_value)
+            server_data['last_value'] = ping_value
+            server_data['new_samples'] += 1
+            
+            # Only rescan the history when the current highest ping falls off
+            if ping_value >= self.highest_ping:
+                self.highest_ping = ping_value
+            elif evicted >= self.highest_ping:
+                self.highest_dirty = True
+            self.dirty = True
+    
+    def quantize_scale(self, max_ping: float) -> int:
+        """Round a scale to the nearest 5ms so nearby scales share guide positions."""
+        return max(5, int(round(max_ping / 5)) * 5)
+    
+    def get_guide_ys(self, scale: int) -> List[int]:
+        ys = self.guide_y_cache.get(scale)
+        if ys is None:
+            height = self.window_config.height
+            y_scale = (height - 20) / scale
+            # Rounded the same way as the graph points so guides line up with them
+            ys = [int(round(height - level * y_scale)) for level in self.visual_config.guide_levels]
+            self.guide_y_cache[scale] = ys
+            if len(self.guide_y_cache) > self.guide_y_cache_size:
+                self.guide_y_cache.popitem(last=False)
+        else:
+            self.guide_y_cache.move_to_end(scale)
+        return ys
     
     def draw_guide_lines(self):
-        if not self.visual_config.show_guides:
-            return
-            
-        for level in self.visual_config.guide_levels:
-            y = int(self.window_config.height - 
-                   (level / self.current_max_ping) * 
-                   (self.window_config.height - 20))
-            
-            # Draw three small lines
-            x_positions = [
-                self.window_config.padding_left,
-                self.window_config.width // 2,
-                self.window_config.width - self.window_config.padding_right
-            ]
-            
+        """Render the guide lines for the current scale into the guide surface."""
+        self.guide_scale = self.quantize_scale(self.current_max_ping)
+        self.guide_surface.fill((0, 0, 0, 0))
+        
+        color = self.visual_config.guide_lines_color
+        thickness = self.visual_config.guide_lines_thickness
+        half_length = self.visual_config.guide_lines_length // 2
+        
+        # Three small lines per level
+        x_positions = [
+            self.window_config.padding_left,
+            self.window_config.width // 2,
+            self.window_config.width - self.window_config.padding_right
+        ]
+        
+        for y in self.get_guide_ys(self.guide_scale):
             for x in x_positions:
                 pygame.draw.line(
-                    self.window,
-                    self.visual_config.guide_lines_color,
-                    (x - self.visual_config.guide_lines_length // 2, y),
-                    (x + self.visual_config.guide_lines_length // 2, y),
-                    self.visual_config.guide_lines_thickness
+                    self.guide_surface,
+                    color,
+                    (x - half_length, y),
+                    (x + half_length, y),
+                    thickness
                 )
     
+    def render_ping_text(self, value: int, color: tuple) -> pygame.Surface:
+        key = (value, color)
+        text_surface = self.text_cache.get(key)
+        if text_surface is None:
+            text_surface = self.font.render(f"{value}ms", True, color)
+            self.text_cache[key] = text_surface
+            if len(self.text_cache) > self.text_cache_size:
+                self.text_cache.popitem(last=False)
+        else:
+            self.text_cache.move_to_end(key)
+        return text_surface
+    
+    def draw_graph(self, server: ServerConfig, server_data: dict, max_ping: float) -> tuple:
+        """Bring a server's graph surface up to date and return its newest point."""
+        graph = server_data['graph']
+        new_samples = server_data['new_samples']
+        server_data['new_samples'] = 0
+        drift = server_data['graph_drift'] + self.x_step - self.scroll_step
+        
+        if server_data['graph_scale'] == max_ping and new_samples == 0:
+            # Nothing changed, reuse the surface as is
+            return server_data['last_point']
+        
+        if server_data['graph_scale'] == max_ping and new_samples == 1 and abs(drift) < 0.5:
+            # Same scale and one new sample: scroll the old line left and
+            # only draw the newest segment
+            width = self.window_config.width
+            height = self.window_config.height
+            graph.scroll(-self.scroll_step, 0)
+            graph.fill((0, 0, 0, 0), (width - self.scroll_step, 0, self.scroll_step, height))
+            graph.fill((0, 0, 0, 0), (0, 0, int(self.xs[0]), height))
+            points = project_points(
+                server_data['values'].latest(2), self.xs[-2:], height, max_ping
+            ).tolist()
+            pygame.draw.line(graph, server.color, points[0], points[1], server.line_thickness)
+            server_data['graph_drift'] = drift
+            server_data['last_point'] = tuple(points[-1])
+            return server_data['last_point']
+        
+        # Scale changed (or scrolling drifted too far): redraw the whole line
+        values = server_data['values'].ordered()
+        xs = self.xs
+        if self.column_starts is not None:
+            values = np.maximum.reduceat(values, self.column_starts)
+            xs = self.column_xs
+        points = project_points(values, xs, self.window_config.height, max_ping).tolist()
+        graph.fill((0, 0, 0, 0))
+        pygame.draw.lines(
+            graph,
+            server.color,  # Use server's color
+            False,
+            points,
+            server.line_thickness
+        )
+        server_data['graph_scale'] = max_ping
+        server_data['graph_drift'] = 0.0
+        server_data['last_point'] = tuple(points[-1])
+        return server_data['last_point']
+    
     def draw(self):
         self.window.fill(self.window_config.background_color)
         
-        # Update scale
-        self.update_scale()
-        
         # Draw guide lines
-        self.draw_guide_lines()
+        if self.visual_config.show_guides:
+            self.window.blit(self.guide_surface, (0, 0))
+        
+        # Graphs and text are blitted in a single batch
+        graph_list = []
+        blit_list = []
+        
+        width = self.window_config.width
+        max_ping = self.current_max_ping
+        offset_x, offset_y = self.visual_config.ping_text_offset
         
         # Draw each server's data
         for server in self.servers:
@@ -279,53 +542,38 @@ class PingVisualizer:
                 continue
                 
             server_data = self.ping_data[server.address]
-            points = []
-            
-            # Calculate points with precise padding
-            for i, value in enumerate(server_data['values']):
-                x = self.window_config.width - self.window_config.padding_right - \
-                    (len(server_data['values']) - i - 1) * \
-                    ((self.window_config.width - self.window_config.padding_left - self.window_config.padding_right) / 
-                     (self.visual_config.max_points - 1))
-                y = self.window_config.height - \
-                    (value / self.current_max_ping) * \
-                    (self.window_config.height - 20)  # Fixed padding for bottom
-                points.append((int(x), int(y)))
             
-            # Draw lines
-            if len(points) >= 2:
-                pygame.draw.lines(
-                    self.window,
-                    server.color,  # Use server's color
-                    False,
-                    points,
-                    server.line_thickness
-                )
+            last_point = self.draw_graph(server, server_data, max_ping)
+            graph_list.append((server_data['graph'], (0, 0)))
             
             # Draw ping value next to the newest point
-            if points:
-                text = f"{server_data['last_value']}ms"
-                text_surface = self.font.render(text, True, server.color)  # Use server's color
-                
-                # Position text relative to the last point
-                last_point = points[-1]
-                text_pos = (
-                    last_point[0] + self.visual_config.ping_text_offset[0],
-                    last_point[1] + self.visual_config.ping_text_offset[1]
-                )
-                
-                # Keep text within window bounds
-                if text_pos[0] + text_surface.get_width() > self.window_config.width:
-                    text_pos = (last_point[0] - text_surface.get_width() - 5, text_pos[1])
-                
-                self.window.blit(text_surface, text_pos)
+            text_surface = self.render_ping_text(server_data['last_value'], server.color)
+            
+            # Position text relative to the last point
+            text_pos = (last_point[0] + offset_x, last_point[1] + offset_y)
+            
+            # Keep text within window bounds
+            if text_pos[0] + text_surface.get_width() > width:
+                text_pos = (last_point[0] - text_surface.get_width() - 5, text_pos[1])
+            
+            blit_list.append((text_surface, text_pos))
         
-        pygame.display.flip()
+        # Graphs first so labels are drawn on top
+        self.window.blits(graph_list + blit_list, doreturn=0)
+        pygame.display.update(self.graph_rect)
     
-    def handle_events(self):
-        for event in pygame.event.get():
+    def handle_events(self, timeout: int = 0):
+        # Block until something happens (or the timeout expires), then drain the queue
+        if timeout > 0:
+            first_event = pygame.event.wait(timeout)
+        else:
+            first_event = pygame.event.wait()
+        
+        for event in [first_event] + pygame.event.get():
             if event.type == pygame.QUIT:
                 self.running = False
+            elif event.type == pygame.VIDEOEXPOSE:
+                self.dirty = True
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     self.running = False
@@ -333,29 +581,47 @@ class PingVisualizer:
                 if event.button == 1:  # Left click
                     self.dragging = True
                     mouse_x, mouse_y = event.pos
-                    hwnd = pygame.display.get_wm_info()["window"]
-                    window_x, window_y = win32gui.GetWindowRect(hwnd)[:2]
+                    window_x, window_y = win32gui.GetWindowRect(self.hwnd)[:2]
                     self.drag_offset = (window_x - mouse_x, window_y - mouse_y)
             elif event.type == pygame.MOUSEBUTTONUP:
                 if event.button == 1:
                     self.dragging = False
             elif event.type == pygame.MOUSEMOTION:
                 if self.dragging:
+                    self.dirty = True
                     mouse_x, mouse_y = event.pos
-                    hwnd = pygame.display.get_wm_info()["window"]
                     x = mouse_x + self.drag_offset[0]
                     y = mouse_y + self.drag_offset[1]
-                    win32gui.SetWindowPos(hwnd, 0, x, y, 0, 0, 
-                                        win32con.SWP_NOSIZE | win32con.SWP_NOZORDER)
+                    win32gui.SetWindowPos(self.hwnd, 0, x, y, 0, 0, 
+                                        win32con.SWP_NOSIZE | win32con.SWP_NOZORDER | win32con.SWP_NOACTIVATE)
 
     def run(self):
-        clock = pygame.time.Clock()
+        frame_time = 1000 / self.visual_config.fps
+        last_frame = pygame.time.get_ticks() - frame_time  # Draw the first frame immediately
         
         while self.running:
-            self.handle_events()
+            # New pings mark the graph dirty as soon as they arrive
             self.update_values()
-            self.draw()
-            clock.tick(self.visual_config.fps)
+            
+            # Events can wake the loop at any time, but only update the scale
+            # and draw once a full frame has passed
+            since_frame = pygame.time.get_ticks() - last_frame
+            if since_frame >= frame_time:
+                last_frame += since_frame
+                # Cap at one frame: after an idle wait the decay should start
+                # from one step, not jump straight to the target
+                self.update_scale(min(since_frame, frame_time) / 1000)
+                if self.dirty:
+                    self.draw()
+                    self.dirty = False
+                since_frame = 0
+            
+            # Wait for the next frame while the scale is animating or a redraw
+            # is pending; otherwise sleep until an input or ping event arrives
+            if self.dirty or self.current_max_ping != self.target_max_ping:
+                self.handle_events(max(1, int(frame_time - since_frame)))
+            else:
+                self.handle_events()
         
         pygame.quit()
 